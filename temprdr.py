@@ -1,8 +1,15 @@
 #!/usr/bin/python3
 
 import pathlib as pl
-import time, argparse, threading, queue
-import json, sys
+import time, argparse, threading, collections, sched
+import concurrent.futures
+import sys, os, atexit, signal, ctypes
+try:
+    import orjson
+    _loads=orjson.loads
+except ImportError:
+    import json
+    _loads=json.loads
 
 ROOTDIR='/sys/bus/w1/devices'
 
@@ -10,6 +17,18 @@ import logging
 logpath = pl.Path.home()/'rrlog.log'
 logging.basicConfig(filename=logpath,level=logging.INFO)
 
+def _open_noatime(path, flags, mode=0o666):
+    """
+    os.open with O_NOATIME added where the platform and permissions (owner of the file or CAP_FOWNER) allow it
+    """
+    noatime=getattr(os, 'O_NOATIME', 0)
+    if noatime:
+        try:
+            return os.open(path, flags|noatime, mode)
+        except PermissionError:
+            pass
+    return os.open(path, flags, mode)
+
 class ds18b20():
     """
     simple class for ds18b20 temperature sensors.
@@ -17,6 +36,10 @@ class ds18b20():
     given the sensor's name (28-.....), the read function can be called to get the current temperature.
     
     It tracks the number of successful and failed reads
+
+    The sensor's w1_slave file is kept open and re-read with pread on each call, call close when finished with the sensor.
+    If a read fails the file is closed and reopened on the next read, so a sensor that drops off the bus and comes back
+    (which re-creates its sysfs node) recovers.
     """
     def __init__(self, name, offset=0.0):
         """
@@ -25,16 +48,35 @@ class ds18b20():
         name        : the sensor's 1-wire name (e.g. 28-nnnnnnnn)
         
         mappedname  : name to use when logging the data
+
+        master      : the bus master the sensor is on (the parent of the sensor's device directory)
         
         offset      : an offset for the read value to allow very basic calibration
         """
         self.name=name
         self.mappedname=name
         self.rdr=pl.Path(ROOTDIR)/name/'w1_slave'
+        self.master=(pl.Path(ROOTDIR)/name).resolve().parent.name
         self.goodreads=0
         self.badreads=0
         self.offset=offset
         self.lasterror=None
+        self._fd=None
+        try:
+            self._fd=_open_noatime(str(self.rdr), os.O_RDONLY)
+        except OSError as e:
+            self.lasterror=str(e)
+
+    def close(self):
+        """
+        closes the sensor's w1_slave file
+        """
+        if not self._fd is None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd=None
 
     def setmapped(self, mappedname):
         self.mappedname=mappedname
@@ -45,17 +87,30 @@ class ds18b20():
         
         returns the temperature (float) in centigrade if the read was OK or None if the read failed
         """
-        with self.rdr.open('r') as trdr:
-            l=trdr.readline().strip()
-            if l.endswith('YES'):
-                ls=trdr.readline().split('t=')
-                tval=int(ls[1])/1000+self.offset
-                self.goodreads+=1
-                return tval
-            else:
+        try:
+            if self._fd is None:
+                self._fd=_open_noatime(str(self.rdr), os.O_RDONLY)
+            buf=os.pread(self._fd, 128, 0)
+        except OSError as e:
+            self.close()
+            self.badreads+=1
+            self.lasterror=str(e)
+            return None
+        eol=buf.find(b'\n')+1
+        toff=buf.find(b't=', eol)
+        if eol > 0 and toff > 0 and buf.endswith(b'YES\n', 0, eol):
+            try:
+                tval=int(buf[toff+2:])/1000.0+self.offset
+            except ValueError:
                 self.badreads+=1
-                self.lasterror=l
+                self.lasterror=buf[eol:].decode('ascii', 'replace').strip()
                 return None
+            self.goodreads+=1
+            return tval
+        else:
+            self.badreads+=1
+            self.lasterror=buf[:eol].decode('ascii', 'replace').strip()
+            return None
 
 def find_devices(devtype='28'):
     """
@@ -71,41 +126,220 @@ def find_devices(devtype='28'):
     else:
         raise RuntimeError('1-wire directory /sys/bus/w1/devices not found')
 
-class rundev():
-    def __init__(self, dev):
-        self.dev=dev
+def bus_bulk_trigger(masters=('w1_bus_master1',), timeout=1.5):
+    """
+    starts a temperature conversion on every sensor on each of the bus masters at the same time, then waits for them to
+    complete.
+
+    Once a master's conversion is done each sensor's w1_slave on that bus can be read without the driver doing another
+    (slow) conversion.
+
+    masters     : list of the names of bus masters in the 1-wire directory
+
+    timeout     : maximum time in seconds to wait for the conversions
+
+    returns a dict with the outcome for each master:
+        'done'      : the conversion completed
+        'nobulk'    : the driver has no bulk read (therm_bulk_read was added in linux 5.10)
+        'noperm'    : therm_bulk_read cannot be written (it is only writable by root)
+        'failed'    : the conversion did not complete in time or the trigger failed
+    """
+    result={}
+    waiting={}
+    for master in masters:
+        trig=pl.Path(ROOTDIR)/master/'therm_bulk_read'
+        if not trig.exists():
+            result[master]='nobulk'
+            continue
+        try:
+            trig.write_text('trigger')
+            waiting[master]=trig
+        except PermissionError:
+            result[master]='noperm'
+        except OSError:
+            result[master]='failed'
+    deadline=time.monotonic()+timeout
+    while waiting and time.monotonic() < deadline:
+        for master, trig in list(waiting.items()):
+            try:
+                if trig.read_text().strip()=='1':
+                    result[master]='done'
+                    del waiting[master]
+            except OSError:
+                result[master]='failed'
+                del waiting[master]
+        if waiting:
+            time.sleep(.05)
+    for master in waiting:
+        result[master]='failed'
+    return result
+
+class runbus():
+    """
+    reads all the sensors once each tick, using a bulk read on each bus master where the driver supports it so the bus
+    time does not grow with the number of sensors. Sensors on masters without bulk read (older drivers, or not running as
+    root) are read concurrently from a small thread pool so their conversions still overlap.
+    """
+    def __init__(self, devs, devorder, cpu=-1, rtpriority=10):
+        """
+        devs        : list of ds18b20 sensors (on any bus master)
+
+        devorder    : list of (mapped) device names, each record queued is a list of readings in this order
+
+        cpu         : cpu to pin the reader thread to, -1 for the last cpu (if there is more than 1), None to not pin
+
+        rtpriority  : SCHED_FIFO priority for the reader thread to reduce tick jitter, None to leave the thread's
+                      scheduling alone. This needs CAP_SYS_NICE (e.g. run as root), without it the normal scheduler is used.
+        """
+        self.devs=devs
+        self.devorder=devorder
+        self.devixs=[devorder.index(dev.mappedname) for dev in devs]
+        self.source='w1'
+        self.masters={}
+        for dev in devs:
+            self.masters.setdefault(dev.master, []).append(dev)
+        self.cpu=cpu
+        self.rtpriority=rtpriority
         self.running=True
+        self.stopping=threading.Event()
+
+    def stop(self):
+        """
+        asks the reader to stop, waking it if it is waiting for the next tick
+        """
+        self.running=False
+        self.stopping.set()
 
-    def runloop(self, dataq, errq, tick=5, startround=5):
-        nexttick=float(((time.time()+.5)//startround)*startround)+startround
-        starttime=time.time()
-        sleeptime=0
+    def runloop(self, dataq, dataready, tick=5, startround=5):
+        """
+        reads the sensors every tick seconds, starting on a multiple of startround seconds (wall clock time)
+
+        dataq is a deque that records are appended to as (timestamp, source, readings, error) tuples - readings is None
+        for error reports and error is None for readings. dataready is an Event set when a set of readings is added.
+
+        the reads are run from a sched.scheduler on the monotonic clock in integer nanoseconds so clock adjustments
+        can't cause spurious overruns or long sleeps, the records queued carry the equivalent wall clock time. The offset
+        between the clocks is checked every tick, if the wall clock is stepped (e.g. by NTP after boot on a pi with no
+        hardware clock) the ticks are re-aligned to the new wall clock time.
+        """
+        self.dataq=dataq
+        self.dataready=dataready
+        self.tick_ns=int(tick*1e9)
+        self.round_ns=int(startround*1e9)
+        self.wall_offset=time.time_ns()-time.monotonic_ns()
+        walltick=((time.monotonic_ns()+self.wall_offset+500000000)//self.round_ns+1)*self.round_ns
+        starttime=time.monotonic_ns()
+        self.sleeptime=0
+        self.bulk={}
+        self.bulkmasters=list(self.masters)
+        self.pool=None
+        self.sch=sched.scheduler(time.monotonic_ns, self._sleep)
         try:
-            logging.info('start device %s with tick %4.1f' %(self.dev.mappedname, tick))    
-            while self.running:
-                delay=nexttick-time.time()
-                if delay > 0:
-                    logging.debug('delay is %3.1f' % delay)
-                    sleeptime += delay
-                    time.sleep(delay)
-                    v=self.dev.read()
-                    if v is None:
-                        errq.put((nexttick, self.dev.mappedname, dev.lasterror))
-                    else:
-                        dataq.put((nexttick, self.dev.mappedname, v))
-                    nexttick += tick
-                else:
-                    tm=time.time()
-                    errq.put((tm, self.dev.mappedname, 'overrun %4.3f' % -delay))
-                    while tm > nexttick:
-                        nexttick+=tick
-                
-            errq.put((time.time(), self.dev.mappedname, 'elapsed time: %6.2f, sleep time: %6.2f' % (time.time()-starttime, sleeptime)))
+            self._setsched()
+            logging.info('start bus %s with tick %4.1f' %(', '.join(self.masters), tick))
+            self.sch.enterabs(walltick-self.wall_offset, 1, self.readtick, (walltick,))
+            self.sch.run()
+            dataq.append((time.time(), self.source, None, 'elapsed time: %6.2f, sleep time: %6.2f' % ((time.monotonic_ns()-starttime)/1e9, self.sleeptime/1e9)))
         except:
             logging.info('ooops!', exc_info=True)
+        finally:
+            if not self.pool is None:
+                self.pool.shutdown()
+
+    def _setsched(self):
+        try:
+            # PR_SET_NAME - sets the kernel's name for this thread (as shown by top / perf), limited to 15 bytes
+            ctypes.CDLL(None).prctl(15, threading.current_thread().name.encode()[:15], 0, 0, 0)
+        except (OSError, AttributeError):
+            pass
+        if not self.cpu is None and hasattr(os, 'sched_setaffinity'):
+            cpus=os.sched_getaffinity(0)
+            cpu=max(cpus) if self.cpu==-1 else self.cpu
+            if len(cpus) > 1 or self.cpu!=-1:
+                try:
+                    os.sched_setaffinity(0, {cpu})
+                    logging.info('reader pinned to cpu %d' % cpu)
+                except OSError as e:
+                    logging.info('unable to pin reader to cpu %d: %s' % (cpu, e))
+        if not self.rtpriority is None and hasattr(os, 'sched_setscheduler'):
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.rtpriority))
+                logging.info('reader using SCHED_FIFO priority %d' % self.rtpriority)
+            except OSError as e:
+                logging.info('unable to set SCHED_FIFO for reader: %s' % e)
+
+    def _sleep(self, delay):
+        if delay > 0:
+            logging.debug('delay is %3.1f' % (delay/1e9))
+            slept=time.monotonic_ns()
+            self.stopping.wait(delay/1e9)
+            self.sleeptime += time.monotonic_ns()-slept
+        if not self.running:
+            for ev in self.sch.queue:
+                self.sch.cancel(ev)
+
+    def readtick(self, walltick):
+        """
+        reads all the sensors for the tick due at wall clock time walltick (in ns) and schedules the next tick
+        """
+        if not self.running:
+            return
+        wall_offset=time.time_ns()-time.monotonic_ns()
+        realign=abs(wall_offset-self.wall_offset) > 1000000000
+        if realign:
+            self.dataq.append((time.time(), self.source, None, 'wall clock moved %4.3f' % ((wall_offset-self.wall_offset)/1e9)))
+            walltick+=wall_offset-self.wall_offset
+        self.wall_offset=wall_offset
+        try:
+            results=bus_bulk_trigger(self.bulkmasters) if self.bulkmasters else {}
+            for master, result in results.items():
+                if result=='noperm':
+                    logging.warning('bus %s bulk read needs root - reading sensors individually' % master)
+                    self.bulkmasters.remove(master)
+                elif result=='nobulk':
+                    logging.warning('bus %s driver has no bulk read - reading sensors individually' % master)
+                    self.bulkmasters.remove(master)
+            fastdevs=[]
+            slowdevs=[]
+            for master, mdevs in self.masters.items():
+                triggered=results.get(master)=='done'
+                if triggered != self.bulk.get(master):
+                    logging.info('bus %s %s bulk read' % (master, 'using' if triggered else 'not using'))
+                    self.bulk[master]=triggered
+                (fastdevs if triggered else slowdevs).extend(mdevs)
+            if len(slowdevs) > 1:
+                if self.pool is None:
+                    self.pool=concurrent.futures.ThreadPoolExecutor(max_workers=len(self.devs), thread_name_prefix='ds18b20-dev')
+                slowvals=self.pool.map(ds18b20.read, slowdevs)
+            else:
+                slowvals=[dev.read() for dev in slowdevs]
+            vals={dev:dev.read() for dev in fastdevs}
+            vals.update(zip(slowdevs, slowvals))
+            tstamp=walltick/1e9
+            devrec=[None]*len(self.devorder)
+            for dev, ix in zip(self.devs, self.devixs):
+                v=vals[dev]
+                if v is None:
+                    self.dataq.append((tstamp, dev.mappedname, None, dev.lasterror))
+                devrec[ix]=v
+            self.dataq.append((tstamp, self.source, devrec, None))
+            self.dataready.set()
+        except Exception:
+            logging.info('ooops! reading sensors', exc_info=True)
+        if self.running:
+            tm=time.monotonic_ns()
+            if realign:
+                nexttick=(walltick//self.round_ns+1)*self.round_ns
+            else:
+                nexttick=walltick+self.tick_ns
+            if tm >= nexttick-wall_offset:
+                self.dataq.append((time.time(), self.source, None, 'overrun %4.3f' % ((tm+wall_offset-nexttick)/1e9)))
+                while tm+wall_offset > nexttick:
+                    nexttick+=self.tick_ns
+            self.sch.enterabs(nexttick-wall_offset, 1, self.readtick, (nexttick,))
 
 class csvfilewriter():
-    def __init__(self, devorder, datafile, squash, tempform='%5.2f', forcewrite=60):
+    def __init__(self, devorder, datafile, squash, tempform='%5.2f', forcewrite=60, flushbytes=4096, flushtime=30):
         """
         sets up info for writing consistent csv file
 
@@ -120,6 +354,11 @@ class csvfilewriter():
                       this makes it easier to visually scan lines from the file as all readings will line up
         
         forcewrite  : if squash is > 0 then a record will always be written after this much time
+
+        flushbytes  : records are held in memory and written to the csv file in one go once this many bytes are pending
+        
+        flushtime   : pending records are also written once the oldest has been waiting this many seconds - checked on
+                      every call to writerec and flushdue - and when the file is closed
         """
         datafilepath=pl.Path(datafile).expanduser()
         self.targname=datafilepath.with_suffix('').name
@@ -128,15 +367,27 @@ class csvfilewriter():
         self.tempform=tempform
         self.squash=squash!=0
         self.sigchange=squash
-        if self.squash:
-            self.lastvals=[999]* len(self.devorder)
+        self.lastvals=[None]* len(self.devorder)
+        self._row=['']+[' ']* len(self.devorder)
         self.forcewrite=forcewrite
-        cands=sorted(self.folder.glob(self.targname+ '*'))
-        if len(cands)==0:
+        self.flushbytes=flushbytes
+        self.flushtime=flushtime
+        self._fh=None
+        self._pending=[]
+        self._pending_bytes=0
+        self._pending_since=0
+        self._last_hour=0
+        self._tstamp_hour=0
+        self._last_tstamp_int=-1
+        self._last_strftime=''
+        self._date_day=None
+        self._date_str=''
+        atexit.register(self.close)
+        lastcand=max(self.folder.glob(self.targname+ '*'), default=None, key=lambda p: p.name)
+        if lastcand is None:
             donew=True
             logging.info('no existing file - new file')
         else:
-            lastcand=cands[-1]
             donew=True
             with lastcand.open('r') as cr:
                 ls=cr.readline().split(',')
@@ -145,62 +396,120 @@ class csvfilewriter():
                 if lss[0]=='time':
                     for ix, dn in enumerate(lss[1:]):
                         if self.devorder[ix]!=dn:
-                            break
                             logging.info('unmatched names - new file')
+                            break
                     else:
                         donew=False
         if donew:
             self.startfile()
         else:
             self.csvfile=lastcand
+            self._openfile()
             logging.info('continue file %s' % lastcand)
         self.lastwrite=0
 
+    def _openfile(self):
+        self._fh=self.csvfile.open('a', buffering=8192)
+
+    def flush(self):
+        """
+        writes any pending records to the csv file
+        """
+        if self._pending:
+            self._fh.write(''.join(self._pending))
+            self._fh.flush()
+            if hasattr(os, 'posix_fadvise'):
+                fd=self._fh.fileno()
+                fulllen=(os.fstat(fd).st_size//4096)*4096
+                if fulllen > 0:
+                    os.posix_fadvise(fd, 0, fulllen, os.POSIX_FADV_DONTNEED)
+            self._pending.clear()
+            self._pending_bytes=0
+
+    def flushdue(self, tstamp):
+        """
+        writes pending records if more than flushbytes are pending or the oldest has been waiting flushtime seconds
+
+        tstamp      : the current (wall clock) time
+        """
+        if self._pending and (self._pending_bytes > self.flushbytes or tstamp-self._pending_since >= self.flushtime):
+            self.flush()
+
+    def close(self):
+        """
+        flushes and closes the current csv file
+        """
+        if not self._fh is None:
+            self.flush()
+            self._fh.close()
+            self._fh=None
+
     def startfile(self):
+        self.close()
         fn='%s_%s' % (self.targname, time.strftime('%y-%m-%d_%H:%M:%S',time.localtime()))
         self.csvfile=(self.folder/fn).with_suffix('.csv')
         self.csvfile.parent.mkdir(parents=True, exist_ok=True)
-        with self.csvfile.open('w') as cw:
-            cw.write('time,%s\n' % ','.join([name for name in self.devorder]))
+        self._openfile()
+        self._fh.write('time,%s\n' % ','.join([name for name in self.devorder]))
+        self._fh.flush()
         self.lastwrite=0
         logging.info('new file created: %s' % str(self.csvfile))
 
-    def writerec(self, tstamp, devdata):
-        vals=[devdata[dname] for dname in self.devorder]
+    def writerec(self, tstamp, vals):
+        """
+        writes a record if appropriate
+
+        tstamp      : the time of the readings
+
+        vals        : list of readings (None for failed reads) in devorder order
+        """
         if not self.csvfile is None:
-            if not self.lastwrite==0:
-                oldti=time.localtime(self.lastwrite)
-                newti=time.localtime(tstamp)
-                if newti.tm_hour<oldti.tm_hour:
-                    self.startfile()
-                    self.lastwrite=0
+            ti=int(tstamp)
+            if ti != self._last_tstamp_int:
+                newti=time.localtime(ti)
+                self._last_tstamp_int=ti
+                if (newti.tm_year, newti.tm_yday) != self._date_day:
+                    self._date_str=time.strftime('%y-%m-%d', newti)
+                    self._date_day=(newti.tm_year, newti.tm_yday)
+                self._last_strftime='%s %02d:%02d:%02d' % (self._date_str, newti.tm_hour, newti.tm_min, newti.tm_sec)
+                self._tstamp_hour=newti.tm_hour
+            if not self.lastwrite==0 and self._tstamp_hour<self._last_hour:
+                self.startfile()
+                self.lastwrite=0
             if not self.squash or tstamp-self.lastwrite >= self.forcewrite:
                 sigchanges=True
             else:
-                sigchanges=False
-                for vi,v in enumerate(vals):
-                    if not v is None and abs(v-self.lastvals[vi]) >= self.sigchange:
-                        sigchanges=True
-                        break
+                sc=self.sigchange
+                sigchanges=any(not v is None and (lv is None or abs(v-lv) >= sc) for v, lv in zip(vals, self.lastvals))
             if sigchanges:
+                lv=self.lastvals
+                row=self._row
+                tf=self.tempform
                 for ix, v in enumerate(vals):
                     if not v is None:
-                        self.lastvals[ix]=v
-                    vstr=','.join([' ' if v is None else self.tempform % v for v in self.lastvals])
-                with self.csvfile.open('a') as cw:
-                    cw.write('%s,%s\n' % (time.strftime('%y-%m-%d %H:%M:%S', time.localtime(tstamp)), vstr))
+                        lv[ix]=v
+                        row[ix+1]=tf % v
+                row[0]=self._last_strftime
+                line=','.join(row)+'\n'
+                if not self._pending:
+                    self._pending_since=tstamp
+                self._pending.append(line)
+                self._pending_bytes+=len(line)
                 self.lastwrite=tstamp
+                self._last_hour=self._tstamp_hour
+            self.flushdue(tstamp)
         else:
             logging.debug('no csvfile')
 
 class gather():
     """
-    assembles readings into complete sets and writes a csv file with option to skip similar readings.
+    passes each complete set of readings to the writers and optionally echoes it to the console.
     The first line is a header with the name of each device 
     """
     def __init__(self, devorder, console, writers):
         """
-        devorder    : list of device names in the order they are written to each line
+        devorder    : list of device names in the order they are written to each line, each record is a list of readings
+                      in this order
         
         console     :  if True, each incoming record is written to stdout (note records may have blank entries
         
@@ -210,14 +519,37 @@ class gather():
         self.console=console
         self.writers=writers
         
-    def writerec(self, tstamp, devdata):
-        vals=[devdata[dname] for dname in self.devorder]
+    def writerec(self, tstamp, vals):
         for writer in self.writers:
-            writer.writerec(tstamp, devdata)        
+            writer.writerec(tstamp, vals)
         if self.console:
             vstr=', ' + ', '.join([' ' if v is None else '%5.1f' % v for v in vals])
             print(time.strftime('%H:%M:%S', time.localtime(tstamp)) +vstr)
 
+def drainrecs(dataq, writer, final=False):
+    """
+    passes every set of readings waiting in dataq to the writer, each is written exactly once. Error reports are logged,
+    or if final is True printed.
+    """
+    while dataq:
+        tstamp, source, devrec, error = dataq.popleft()
+        if not error is None:
+            if final:
+                print('Final driver report', source, error)
+            else:
+                logging.info('Driver report %s: %s' % (source, error))
+            continue
+        logging.debug('%s record with %d readings' % (time.strftime('%X', time.localtime()), len(devrec)))
+        writer.writerec(tstamp, devrec)
+
+def sigterm_handler(signum, frame):
+    """
+    turns SIGTERM (e.g. from shutdown) into KeyboardInterrupt so pending records are written and files closed, further
+    SIGTERMs are ignored so they don't interrupt the shutdown
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt()
+
 def validtick(tickstr):
     try:
         tick=float(tickstr)
@@ -241,8 +573,7 @@ if __name__=='__main__':
             sys.exit(1)
         else:
             try:
-                with confpath.open('r') as cf:
-                    config=json.load(cf)
+                config=_loads(confpath.read_bytes())
             except:
                 print('failed to load config from %s' % str(confpath))
                 raise
@@ -262,9 +593,8 @@ if __name__=='__main__':
     if not 'datafile' in config:
         config['datafile']=args.datafile
     devs=find_devices() 
-    dqueue=queue.Queue()
-    errqueue=queue.Queue()
-    readers=[rundev(dev) for dev in devs]
+    dqueue=collections.deque()
+    dataready=threading.Event()
     if 'namemap' in config:
         devids=[e[0] for e in config['namemap']]
         devnames=[e[1] for e in config['namemap']]
@@ -278,68 +608,36 @@ if __name__=='__main__':
     else:
         devnames=[dev.name for dev in devs]
     logging.info('start using devices %s' % (', '.join([dev.name if dev.name==dev.mappedname else '%s->%s' % (dev.name, dev.mappedname) for dev in devs])))
-    threads=[threading.Thread(target=areader.runloop, kwargs={'dataq':dqueue, 'errq':errqueue, 'tick':config['tick'], 'startround':5}) for areader in readers]
-    for t in threads:
-        t.start()
+    reader=runbus(devs, devnames, **config.get('readerparams',{}))
+    rthread=threading.Thread(name='ds18b20-reader', target=reader.runloop, kwargs={'dataq':dqueue, 'dataready':dataready, 'tick':config['tick'], 'startround':5})
+    rthread.start()
     csvwriter = csvfilewriter(
                 devorder=devnames,
                 **config.get('csvparams',{}))
     writer=gather(devorder=devnames, console=not args.livelog is None, writers=[csvwriter])
-    devrec={dn:None for dn in devnames}
+    signal.signal(signal.SIGTERM, sigterm_handler)
     try:
-        while True:
-            time.sleep(1)
-            logging.debug('try read')
-            try:
-                tstamp, devname, value = dqueue.get(block=True, timeout=.7)
-                logging.debug('%s dev %s is %3.2f' % (time.strftime('%X', time.localtime()), devname, value))
-            except queue.Empty:
-                tstamp=None
+        while rthread.is_alive():
+            if not dataready.wait(timeout=config['tick']):
                 logging.debug('empty queue')
-            if not tstamp is None:
-                devrec[devname]=value
-                time.sleep(.1)
-                ntstamp=tstamp
-                try:
-                    while True:
-                        ntstamp, devname, value = dqueue.get(block=False)
-                        if abs(ntstamp-tstamp) < 1 and devrec[devname] is None:
-                            devrec[devname]=value
-                            logging.debug('%s is %4.2f' % (devname, value))
-                        else:
-                            logging.debug('timeout writing record')
-                            writer.writerec(tstamp, devrec)
-                            devrec={dn:None for dn in devnames}
-                            devrec[devname]=value
-                except queue.Empty:
-                    writer.writerec(tstamp, devrec)
-                    logging.debug('empty writing record')
-                    devrec={dn:None for dn in devnames}
-                    tstamp=ntstamp
-            tstamp=0
-            while not tstamp is None:
-                try:
-                    tstamp, devname, error=errqueue.get(block=False)
-                except queue.Empty:
-                    tstamp=None
-                if not tstamp is None:
-                    logging.info('Driver report %s: %s' % (devname, error))
+            dataready.clear()
+            drainrecs(dqueue, writer)
+            csvwriter.flushdue(time.time())
+        logging.error('reader thread has stopped')
             
     except KeyboardInterrupt:
         pass
     except:
         logging.exception('!!!!')
     finally:
-        for r in readers:
-            r.running=False
-        for t in threads:
-            t.join()
-    tstamp=0
-    while not tstamp is None:
+        reader.stop()
         try:
-            tstamp, devname, error=errqueue.get(block=False)
-        except queue.Empty:
-            tstamp=None
-        if not tstamp is None:
-            print('Final driver report', devname, error)
+            drainrecs(dqueue, writer, final=True)
+            csvwriter.flush()
+            rthread.join()
+            for dev in devs:
+                dev.close()
+            drainrecs(dqueue, writer, final=True)
+        finally:
+            csvwriter.close()
     logging.info('closing')